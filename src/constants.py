@@ -5,7 +5,7 @@
 """
 
 
-ALLOWED_OPERATORS = {"+", "-", "*", "/", "//", "%", "**"}
+ALLOWED_OPERATORS = frozenset({"+", "-", "*", "/", "//", "%", "**"})
 
 
 BUILTIN_FUNCTIONS = {
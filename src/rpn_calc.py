@@ -1,7 +1,8 @@
 from __future__ import annotations
+import functools
 import math
-import re
-from typing import Any, List
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from src.constants import BUILTIN_FUNCTIONS
 from src.constants import ALLOWED_OPERATORS
 
@@ -11,205 +12,420 @@ class CalculatorError(Exception):
     pass
 
 
-_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
-_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
-
-
-def _find_matching_parenthesis(expression: str, start: int) -> int:
-    """Находит позицию закрывающей скобки для открывающей на позиции start."""
-    depth = 1
-    pos = start + 1
-    while pos < len(expression) and depth > 0:
-        if expression[pos] == '(':
-            depth += 1
-        elif expression[pos] == ')':
-            depth -= 1
-        pos += 1
-    if depth == 0:
-        return pos - 1
-    raise CalculatorError("Несбалансированные скобки")
+# Символы, из которых состоят бинарные операторы ("+", "//", "**" и т.д.)
+_OPERATOR_CHARS = frozenset("".join(ALLOWED_OPERATORS))
+
+# Классы символов для токенизатора; диапазон _CC_DIGIT.._CC_OPCHAR — символы,
+# допустимые внутри имени функции или оператора
+_CC_INVALID = 0
+_CC_SPACE = 1
+_CC_DIGIT = 2
+_CC_ALPHA = 3
+_CC_ALNUM = 4  # прочие буквенно-цифровые символы (допустимы только внутри имени)
+_CC_UNDERSCORE = 5
+_CC_OPCHAR = 6
+_CC_DOT = 7
+_CC_OPEN = 8
+_CC_UNARY = 9
+_CC_CLOSE = 10
+
+
+def _char_class(char: str) -> int:
+    """Определяет класс символа для токенизатора."""
+    if char.isspace():
+        return _CC_SPACE
+    if char == '(':
+        return _CC_OPEN
+    if char == ')':
+        return _CC_CLOSE
+    if char.isdigit():
+        return _CC_DIGIT
+    if char in _OPERATOR_CHARS:
+        return _CC_OPCHAR
+    if char.isalpha():
+        return _CC_ALPHA
+    if char.isalnum():
+        return _CC_ALNUM
+    if char == '_':
+        return _CC_UNDERSCORE
+    if char == '.':
+        return _CC_DOT
+    if char in ('$', '~'):
+        return _CC_UNARY
+    return _CC_INVALID
+
+
+# Таблица классов для ASCII: позволяет классифицировать всю строку одним bytes.translate
+_CHARCLASS = bytes(_char_class(chr(code)) if code < 128 else _CC_INVALID for code in range(256))
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_number(token: str) -> Any:
+    """Преобразует числовой токен в int/float; для не-числа возвращает None.
+
+    Литералы (и имена операторов) в выражениях повторяются, поэтому результат кэшируется.
+    """
+    body = token[1:] if token[0] == '-' else token
+    int_part, dot, frac_part = body.partition('.')
+    if not int_part.isdecimal() or (dot and not frac_part.isdecimal()):
+        return None
+    try:
+        return float(token) if dot else int(token)
+    except ValueError as exc:
+        # int() отказывается разбирать слишком длинные литералы
+        raise CalculatorError(f"Некорректное число: {exc}") from exc
 
 
 def _tokenize_expression(expression: str) -> List[str]:
-    """Разбивает выражение на токены, сохраняя вложенные выражения."""
+    """Разбивает выражение на токены.
+
+    Скобки вложенных выражений выдаются отдельными токенами '(' и ')', поэтому
+    всё выражение разбирается за один проход независимо от глубины вложенности.
+    """
     tokens = []
     i = 0
     length = len(expression)
+    depth = 0
+
+    # Классы всех символов вычисляются заранее, в цикле остаётся одно чтение байта
+    if expression.isascii():
+        classes = expression.encode('ascii').translate(_CHARCLASS)
+    else:
+        classes = bytes(_char_class(char) for char in expression)
 
     while i < length:
-        char = expression[i]
+        cls = classes[i]
 
-        if char.isspace():
+        if cls == _CC_SPACE:
             i += 1
             continue
 
-        # Если встретили '(', ищем соответствующую ')'
-        if char == '(':
-            end = _find_matching_parenthesis(expression, i)
-            tokens.append(expression[i:end + 1])
-            i = end + 1
+        if cls == _CC_OPEN:
+            tokens.append('(')
+            depth += 1
+            i += 1
             continue
 
-        if char.isdigit() or (char == '-' and i + 1 < length and expression[i + 1].isdigit()):
+        # Лишняя ')' без пары обрабатывается как неизвестный символ
+        if cls == _CC_CLOSE and depth > 0:
+            tokens.append(')')
+            depth -= 1
+            i += 1
+            continue
+
+        if cls == _CC_DIGIT or (expression[i] == '-' and i + 1 < length
+                                and classes[i + 1] == _CC_DIGIT):
             start = i
             i += 1
-            while i < length and (expression[i].isdigit() or expression[i] == '.'):
+            while i < length and (classes[i] == _CC_DIGIT or classes[i] == _CC_DOT):
                 i += 1
             tokens.append(expression[start:i])
             continue
 
-        if char in ALLOWED_OPERATORS or char.isalpha():
+        if cls == _CC_OPCHAR or cls == _CC_ALPHA:
             start = i
             i += 1
-            while i < length and (expression[i] in ALLOWED_OPERATORS or
-                                 expression[i].isalnum() or expression[i] == '_'):
+            while i < length and _CC_DIGIT <= classes[i] <= _CC_OPCHAR:
                 i += 1
             tokens.append(expression[start:i])
             continue
 
         # Унарные символы ($ — унарный плюс, ~ — унарный минус)
-        if char in ('$', '~'):
-            tokens.append(char)
+        if cls == _CC_UNARY:
+            tokens.append(expression[i])
             i += 1
             continue
 
-        raise CalculatorError(f"Неизвестный символ: {char!r}")
+        raise CalculatorError(f"Неизвестный символ: {expression[i]!r}")
+
+    if depth:
+        raise CalculatorError("Несбалансированные скобки")
 
     return tokens
 
 
-def _call_builtin(name: str, args: List[Any]) -> Any:
-    """Вызов встроенной функции."""
-    if name not in BUILTIN_FUNCTIONS:
-        raise CalculatorError(f"Неизвестная функция: {name!r}")
-    min_args, max_args = BUILTIN_FUNCTIONS[name]
-    if not (min_args <= len(args) <= max_args):
-        raise CalculatorError(
-            f"Функция {name} ожидает от {min_args} до {max_args} аргументов; получено {len(args)}."
-        )
+def _call1(name: str, fn: Callable[[Any], Any], a: Any) -> Any:
+    """Вызов встроенной функции от одного аргумента."""
     try:
-        if name == "abs":
-            return abs(args[0])
-        if name == "sqrt":
-            return math.sqrt(args[0])
-        if name == "pow":
-            return pow(args[0], args[1])
-        if name == "max":
-            return max(args)
-        if name == "min":
-            return min(args)
+        return fn(a)
     except Exception as exc:
         raise CalculatorError(f"Ошибка при выполнении {name}: {exc}") from exc
 
 
-def _apply_operator(a: Any, b: Any, op: str) -> Any:
-    """Выполнение бинарных операций."""
-    if op == "+":
-        return a + b
-    if op == "-":
-        return a - b
-    if op == "*":
-        return a * b
-    if op == "/":
-        if b == 0:
-            raise CalculatorError("Деление на ноль")
-        return a / b
-    if op == "//":
-        if not isinstance(a, int) or not isinstance(b, int):
-            raise CalculatorError("// требует целых операндов")
-        if b == 0:
-            raise CalculatorError("Деление на ноль")
-        return a // b
-    if op == "%":
-        if not isinstance(a, int) or not isinstance(b, int):
-            raise CalculatorError("% требует целых операндов")
-        if b == 0:
-            raise CalculatorError("Деление на ноль")
-        return a % b
-    if op == "**":
-        return a ** b
-    raise CalculatorError(f"Неизвестный оператор: {op!r}")
-
-
-def _evaluate_tokens(tokens: List[str]) -> Any:
-    """Рекурсивно вычисляет выражение из токенов."""
-    stack: List[Any] = []
-
-    for token in tokens:
-        # Вложенное выражение — рекурсивный вызов evaluate_rpn_input()
-        if token.startswith('(') and token.endswith(')'):
-            result = evaluate_rpn_input(token)
-            stack.append(result)
-            continue
+def _call2(name: str, fn: Callable[[Any, Any], Any], a: Any, b: Any) -> Any:
+    """Вызов встроенной функции от двух аргументов."""
+    try:
+        return fn(a, b)
+    except Exception as exc:
+        raise CalculatorError(f"Ошибка при выполнении {name}: {exc}") from exc
+
+
+def _calln(name: str, fn: Callable[[List[Any]], Any], args: List[Any]) -> Any:
+    """Вызов встроенной функции с переменным числом аргументов (арность уже проверена)."""
+    try:
+        return fn(args)
+    except Exception as exc:
+        raise CalculatorError(f"Ошибка при выполнении {name}: {exc}") from exc
 
-        if _NUMBER_RE.fullmatch(token):
-            value = float(token) if "." in token else int(token)
-            stack.append(value)
+
+# Реализации встроенных функций
+_BUILTIN_IMPLS: Dict[str, Callable[..., Any]] = {
+    "abs": abs,
+    "sqrt": math.sqrt,
+    "pow": pow,
+    "max": max,
+    "min": min,
+}
+
+# Имя -> (min_args, max_args, реализация): всё нужное для компиляции вызова одним обращением
+_BUILTIN_HANDLERS: Dict[str, Tuple[int, int, Callable[..., Any]]] = {
+    name: (min_args, max_args, _BUILTIN_IMPLS[name])
+    for name, (min_args, max_args) in BUILTIN_FUNCTIONS.items()
+}
+
+
+# Бинарные операторы: символ -> функция из модуля operator
+_BINOPS: Dict[str, Callable[[Any, Any], Any]] = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "//": operator.floordiv,
+    "%": operator.mod,
+    "**": operator.pow,
+}
+
+# Коды операций скомпилированной программы
+_OP_PUSH = 0
+_OP_NEG = 1
+_OP_ADD = 2
+_OP_SUB = 3
+_OP_MUL = 4
+_OP_DIV = 5
+_OP_FDIV = 6
+_OP_MOD = 7
+_OP_POW = 8
+_OP_ABS = 9
+_OP_SQRT = 10
+_OP_POWF = 11
+_OP_MAX = 12
+_OP_MIN = 13
+_OP_POS = 14
+_OP_CALL = 15  # вложенная подпрограмма; встраивается в _link и не доходит до _run
+
+# Токен -> код операции
+_OPCODES: Dict[str, int] = {
+    "~": _OP_NEG,
+    "$": _OP_POS,
+    "+": _OP_ADD,
+    "-": _OP_SUB,
+    "*": _OP_MUL,
+    "/": _OP_DIV,
+    "//": _OP_FDIV,
+    "%": _OP_MOD,
+    "**": _OP_POW,
+    "abs": _OP_ABS,
+    "sqrt": _OP_SQRT,
+    "pow": _OP_POWF,
+    "max": _OP_MAX,
+    "min": _OP_MIN,
+}
+
+Program = Tuple[Tuple[int, Any], ...]
+
+
+def _compile_token(token: str) -> Optional[Tuple[int, Any]]:
+    """Компилирует число или оператор в инструкцию; для прочих токенов возвращает None."""
+    value = _parse_number(token)
+    if value is not None:
+        return (_OP_PUSH, value)
+    opcode = _OPCODES.get(token)
+    if opcode is None:
+        return None
+    return (opcode, token)
+
+
+def _link(program: List[Tuple[int, Any]]) -> Program:
+    """Проверяет глубину стека, фиксирует число аргументов функций и встраивает подпрограммы.
+
+    Глубина стека в RPN известна статически, поэтому все ошибки нехватки операндов
+    обнаруживаются один раз при компиляции, а не при каждом выполнении программы.
+    """
+    linked: List[Tuple[int, Any]] = []
+    depth = 0
+
+    for opcode, arg in program:
+        # Подпрограмма уже проверена и оставляет ровно одно значение поверх текущего
+        # стека, не трогая его, поэтому её инструкции встраиваются в общий поток
+        if opcode == _OP_CALL:
+            linked.extend(arg)
+            depth += 1
             continue
 
-        if token in ("$", "~"):
-            if not stack:
+        if opcode == _OP_PUSH:
+            depth += 1
+        elif opcode == _OP_NEG or opcode == _OP_POS:
+            if depth < 1:
                 raise CalculatorError("Недостаточно операндов для унарной операции")
-            a = stack.pop()
-            stack.append(+a if token == "$" else -a)
+        elif opcode <= _OP_POW:
+            if depth < 2:
+                raise CalculatorError(f"Недостаточно операндов для оператора {arg}")
+            depth -= 1
+            arg = _BINOPS[arg]
+        else:
+            # Функции с переменным числом аргументов забирают весь доступный стек
+            min_args, max_args, fn = _BUILTIN_HANDLERS[arg]
+            if depth < min_args:
+                raise CalculatorError(f"Недостаточно аргументов для функции {arg!r}")
+            num_args = min(depth, max_args)
+            depth -= num_args - 1
+            arg = (arg, fn, num_args)
+        linked.append((opcode, arg))
+
+    # После вычисления в стеке должно остаться ровно одно значение
+    if depth != 1:
+        raise CalculatorError("Неправильное выражение: стек не свёлся к одному значению")
+
+    return tuple(linked)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(expression: str) -> Program:
+    """Компилирует выражение (без внешних скобок) в программу из пар (код, аргумент)."""
+    program: List[Tuple[int, Any]] = []
+
+    # Быстрый путь: без скобок и со всеми токенами, разделёнными пробелами,
+    # хватает str.split(); иначе (например, "3 4+") используется посимвольный разбор
+    if '(' not in expression:
+        for part in expression.split():
+            instruction = _compile_token(part)
+            if instruction is None:
+                break
+            program.append(instruction)
+        else:
+            return _link(program)
+        program.clear()
+
+    # Программы объемлющих выражений, ожидающие завершения вложенного
+    frames: List[List[Tuple[int, Any]]] = []
+
+    for token in _tokenize_expression(expression):
+        # Вложенное выражение собирается в отдельную подпрограмму без рекурсии
+        if token == '(':
+            frames.append(program)
+            program = []
             continue
 
-        if token in ALLOWED_OPERATORS:
-            if len(stack) < 2:
-                raise CalculatorError(f"Недостаточно операндов для оператора {token}")
-            b = stack.pop()
-            a = stack.pop()
-            stack.append(_apply_operator(a, b, token))
+        if token == ')':
+            subprogram = _link(program)
+            program = frames.pop()
+            program.append((_OP_CALL, subprogram))
             continue
 
-        if token in BUILTIN_FUNCTIONS:
-            min_args, max_args = BUILTIN_FUNCTIONS[token]
+        instruction = _compile_token(token)
+        if instruction is None:
+            raise CalculatorError(f"Неизвестный токен: {token!r}")
+        program.append(instruction)
+
+    return _link(program)
+
+
+def _run(
+    program: Program,
+    *,
+    _OP_PUSH: int = _OP_PUSH,
+    _OP_NEG: int = _OP_NEG,
+    _OP_POS: int = _OP_POS,
+    _OP_DIV: int = _OP_DIV,
+    _OP_FDIV: int = _OP_FDIV,
+    _OP_MOD: int = _OP_MOD,
+    _OP_POW: int = _OP_POW,
+    _call1: Callable[..., Any] = _call1,
+    _call2: Callable[..., Any] = _call2,
+    _calln: Callable[..., Any] = _calln,
+    isinstance: Callable[..., bool] = isinstance,
+) -> Any:
+    """Выполняет скомпилированную программу на стековой машине.
+
+    Глубина стека проверена в _link, поэтому проверки нехватки операндов здесь не нужны;
+    бинарные операторы уже разрешены в функции модуля operator.
+    Стек выделяется заранее (глубина не превышает длины программы) и адресуется
+    указателем вершины sp.
+
+    Именованные параметры по умолчанию фиксируют глобальные имена, используемые
+    в цикле, как локальные переменные; передавать их не нужно.
+    """
+    stack: List[Any] = [None] * len(program)
+    sp = 0
+
+    for opcode, arg in program:
+        if opcode == _OP_PUSH:
+            stack[sp] = arg
+            sp += 1
+            continue
 
-            if max_args > min_args:
-                if len(stack) < min_args:
-                    raise CalculatorError(f"Недостаточно аргументов для функции {token!r}")
-                num_args = min(len(stack), max_args)
-            else:
-                if len(stack) < min_args:
-                    raise CalculatorError(f"Недостаточно аргументов для функции {token!r}")
-                num_args = min_args
+        if opcode == _OP_NEG or opcode == _OP_POS:
+            a = stack[sp - 1]
+            stack[sp - 1] = -a if opcode == _OP_NEG else +a
+            continue
 
-            args = [stack.pop() for _ in range(num_args)][::-1]
-            stack.append(_call_builtin(token, args))
+        if opcode <= _OP_POW:
+            sp -= 1
+            b = stack[sp]
+            a = stack[sp - 1]
+            # Проверки операндов для /, // и % выполняются на месте, без вызова функции
+            if _OP_DIV <= opcode <= _OP_MOD:
+                if opcode != _OP_DIV and (not isinstance(a, int) or not isinstance(b, int)):
+                    raise CalculatorError(
+                        f"{'//' if opcode == _OP_FDIV else '%'} требует целых операндов"
+                    )
+                if b == 0:
+                    raise CalculatorError("Деление на ноль")
+            stack[sp - 1] = arg(a, b)
             continue
 
-        raise CalculatorError(f"Неизвестный токен: {token!r}")
+        name, fn, num_args = arg
 
-    # После вычисления в стеке должно остаться ровно одно значение
-    if len(stack) != 1:
-        raise CalculatorError("Неправильное выражение: стек не свёлся к одному значению")
+        if num_args == 1:
+            stack[sp - 1] = _call1(name, fn, stack[sp - 1])
+            continue
+
+        if num_args == 2:
+            sp -= 1
+            stack[sp - 1] = _call2(name, fn, stack[sp - 1], stack[sp])
+            continue
+
+        base = sp - num_args
+        stack[base] = _calln(name, fn, stack[base:sp])
+        sp = base + 1
 
     return stack[0]
 
 
-def evaluate_rpn_input(rpn_expression: str) -> Any:
-    """Вычисляет выражение, записанное в обратной польской нотации (RPN)."""
-    try:
-        if not isinstance(rpn_expression, str):
-            raise CalculatorError("Входное выражение должно быть строкой.")
+@functools.lru_cache(maxsize=4096)
+def _evaluate_rpn_impl(rpn_expression: str) -> Any:
+    """Вычисляет RPN-строку; результат кэшируется, так как вычисления чистые."""
+    text = rpn_expression.strip()
 
-        text = rpn_expression.strip()
+    # Снимаем внешние скобки, если они есть; выражение без скобок уже является
+    # их содержимым, поэтому оборачивать его не нужно
+    if text.startswith("(") and text.endswith(")"):
+        text = text[1:-1].strip()
 
-        # Автоматически добавляем внешние скобки если их нет
-        if not (text.startswith("(") and text.endswith(")")):
-            text = f"({text})"
+    # Компилируем содержимое (программа кэшируется)
+    program = _compile(text)
 
-        # Извлекаем содержимое скобок и токенизируем
-        inner_text = text[1:-1].strip()
-        tokens = _tokenize_expression(inner_text)
+    # Ошибки операндов и деление на ноль обнаруживаются явными проверками;
+    # остаются только 0 ** -1 и переполнение float в / и **
+    try:
+        return _run(program)
+    except ArithmeticError as exc:
+        raise CalculatorError(f"Ошибка вычисления: {exc}") from exc
 
-        return _evaluate_tokens(tokens)
 
-    except IndexError:
-        raise CalculatorError("Недостаточно операндов для операции")
-    except ZeroDivisionError:
-        raise CalculatorError("Деление на ноль")
-    except CalculatorError:
-        raise
-    except Exception as exc:
-        raise CalculatorError(f"Ошибка вычисления: {exc}")
+def evaluate_rpn_input(rpn_expression: str) -> Any:
+    """Вычисляет выражение, записанное в обратной польской нотации (RPN)."""
+    # Проверка типа до обращения к кэшу: нехешируемый ввод не должен давать TypeError
+    if not isinstance(rpn_expression, str):
+        raise CalculatorError("Входное выражение должно быть строкой.")
+    return _evaluate_rpn_impl(rpn_expression)
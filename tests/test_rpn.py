@@ -56,3 +56,44 @@ def test_invalid_types_for_int_ops() -> None:
     for expr in ["(7.5 2 //)", "(7.5 2 %)"]:
         with pytest.raises(CalculatorError):
             evaluate_rpn_input(expr)
+
+
+def test_number_literals() -> None:
+    assert evaluate_rpn_input("(3 -5 +)") == -2
+    assert evaluate_rpn_input("(1.5 2 *)") == 3.0
+    for expr in ["(1.2.3)", "(3. 1 +)"]:
+        with pytest.raises(CalculatorError):
+            evaluate_rpn_input(expr)
+
+
+def test_nested_expressions() -> None:
+    assert evaluate_rpn_input("(8 (3 2 +) -) 4 *") == 12
+    assert evaluate_rpn_input("((1 2 +) (3 4 +) *)") == 21
+    with pytest.raises(CalculatorError):
+        evaluate_rpn_input("(2 (3 +))")
+
+
+def test_non_string_input() -> None:
+    for value in [None, 42, ["1", "2", "+"]]:
+        with pytest.raises(CalculatorError):
+            evaluate_rpn_input(value)  # type: ignore[arg-type]
+
+
+def test_tokens_without_spaces() -> None:
+    assert evaluate_rpn_input("(3 4+)") == 7
+    assert evaluate_rpn_input("(9sqrt 2*)") == 6.0
+    assert evaluate_rpn_input("5 3~*") == -15
+
+
+def test_arithmetic_errors() -> None:
+    for expr in ["(0 -1 **)", "(10.0 400 **)", "(1 ~ sqrt)", "(" + "9" * 5000 + ")"]:
+        with pytest.raises(CalculatorError):
+            evaluate_rpn_input(expr)
+
+
+def test_unbalanced_and_deep_nesting() -> None:
+    for expr in ["(1 (2 3 +)", "(1 2 +))", "((1) 2"]:
+        with pytest.raises(CalculatorError):
+            evaluate_rpn_input(expr)
+    depth = 5000
+    assert evaluate_rpn_input("(" * depth + "2" + ")" * depth) == 2